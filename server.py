@@ -1,29 +1,186 @@
 #!/usr/bin/env python3
 """Hyperliquid Funding Analyzer - Server with SQLite backend."""
 
+import gzip
+import hashlib
+import http.client
 import http.server
 import json
 import sqlite3
 import os
+import queue
+import random
+import re
+import threading
 import time
 import urllib.parse
-import urllib.request
 import urllib.error
 
+try:
+    import orjson
+except ImportError:  # orjson é opcional; cai para o json da stdlib
+    orjson = None
+
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'funding.db')
+POOL_SIZE = 4
+POOL_TIMEOUT = 2
+WRITE_RETRIES = 5
+GZIP_MIN_SIZE = 1024
+HL_HOST = 'api.hyperliquid.xyz'
+HL_URL = f'https://{HL_HOST}/info'
 
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+if orjson is not None:
+    def _dumps(obj):
+        return orjson.dumps(obj)
+
+    _loads = orjson.loads
+else:
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    _loads = json.loads
+
+
+def connect_db():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
+    # Ajustes por conexão (journal_mode=WAL é persistente, fica no init_db)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA journal_size_limit=67108864")
     return conn
 
 
+# ── Connection pool ──────────────────────────────────
+# Conexões de leitura reutilizadas entre requests, mais uma única conexão
+# de escrita protegida por lock (SQLite só aceita um writer por vez).
+# Se o pool ficar vazio por POOL_TIMEOUT segundos, abre uma conexão
+# temporária em vez de bloquear o request.
+
+_POOL = queue.Queue(maxsize=POOL_SIZE)
+_WRITE_CONN = None
+_WRITE_LOCK = threading.Lock()
+
+
+def init_pool():
+    global _WRITE_CONN
+    for _ in range(POOL_SIZE):
+        _POOL.put(connect_db())
+    _WRITE_CONN = connect_db()
+    threading.Thread(target=_writer_loop, name='db-writer', daemon=True).start()
+
+
+def get_db():
+    try:
+        return _POOL.get(timeout=POOL_TIMEOUT)
+    except queue.Empty:
+        return connect_db()
+
+
+def release_db(conn):
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _POOL.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def get_write_db():
+    _WRITE_LOCK.acquire()
+    return _WRITE_CONN
+
+
+def release_write_db(conn):
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    finally:
+        _WRITE_LOCK.release()
+
+
+# ── Background writer ────────────────────────────────
+# Os POSTs só enfileiram a escrita e respondem na hora; uma thread dedicada
+# aplica os jobs pendentes numa única transação (um SAVEPOINT por job, para
+# que um job com erro não desfaça os outros). flush_writes() espera a fila
+# esvaziar.
+
+_WRITE_Q = queue.Queue()
+
+
+def enqueue_write(label, job):
+    _WRITE_Q.put((label, job))
+
+
+def flush_writes():
+    _WRITE_Q.join()
+
+
+def _apply_batch(conn, jobs):
+    conn.execute('BEGIN IMMEDIATE')
+    for label, job in jobs:
+        conn.execute('SAVEPOINT job')
+        try:
+            job(conn)
+            conn.execute('RELEASE job')
+        except Exception as e:
+            conn.execute('ROLLBACK TO job')
+            conn.execute('RELEASE job')
+            print(f"[WRITER] {label} - FAILED: {e}")
+    conn.commit()
+
+
+def _run_batch(jobs):
+    # Erros do SQLite no BEGIN/COMMIT (ex.: SQLITE_BUSY) repetem o lote
+    # inteiro, soltando o lock entre as tentativas. Retorna None se o lote
+    # foi aplicado, ou o último erro se desistiu.
+    error = None
+    for attempt in range(WRITE_RETRIES):
+        conn = get_write_db()
+        try:
+            _apply_batch(conn, jobs)
+            return None
+        except sqlite3.OperationalError as e:
+            error = e
+            print(f"[WRITER] batch of {len(jobs)} - {e} (attempt {attempt + 1}/{WRITE_RETRIES})")
+        except Exception as e:
+            return e
+        finally:
+            release_write_db(conn)
+        if attempt < WRITE_RETRIES - 1:
+            time.sleep(backoff_delay(attempt))
+    return error
+
+
+def _writer_loop():
+    while True:
+        jobs = [_WRITE_Q.get()]
+        while True:
+            try:
+                jobs.append(_WRITE_Q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            error = _run_batch(jobs)
+            if error is not None:
+                for label, _ in jobs:
+                    print(f"[WRITER] {label} - LOST: {error}")
+        finally:
+            for _ in jobs:
+                _WRITE_Q.task_done()
+
+
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = get_db()
+    conn = connect_db()
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.executescript('''
+        -- Cache é derivado das tabelas; recriado a cada start
+        DROP TABLE IF EXISTS response_cache;
         CREATE TABLE IF NOT EXISTS market_data (
             coin TEXT PRIMARY KEY,
             data TEXT NOT NULL
@@ -44,116 +201,289 @@ def init_db():
             value TEXT NOT NULL,
             updated_at INTEGER DEFAULT 0
         );
+        CREATE TABLE IF NOT EXISTS response_cache (
+            endpoint TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            body_gz BLOB,
+            etag TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_fh_last_update ON funding_history(last_update);
+        CREATE VIEW IF NOT EXISTS v_market_data AS
+            SELECT json_group_array(json(data)) AS body FROM market_data;
+        CREATE VIEW IF NOT EXISTS v_funding_history AS
+            SELECT json_group_object(coin, json(history)) AS body FROM funding_history;
     ''')
     conn.commit()
     conn.close()
     print(f"Database: {DB_PATH}")
 
 
+# ── Response cache ───────────────────────────────────
+# Respostas agregadas dos GETs grandes, já serializadas. São reconstruídas
+# nos POSTs em lote e invalidadas pelas escritas parciais. Os agregados são
+# montados pelo próprio SQLite (JSON1) nas views v_market_data e
+# v_funding_history, sem json.loads por linha no Python.
+
+def _build_market_data(conn):
+    return conn.execute('SELECT body FROM v_market_data').fetchone()['body'].encode('utf-8')
+
+
+def _build_funding_history(conn):
+    return conn.execute('SELECT body FROM v_funding_history').fetchone()['body'].encode('utf-8')
+
+
+def _build_stats(conn):
+    row = conn.execute('''
+        SELECT COUNT(*) as coins,
+               COALESCE(SUM(record_count), 0) as total_records,
+               -- Subqueries escalares usam idx_fh_last_update; no mesmo
+               -- SELECT do SUM o SQLite faria scan da tabela
+               (SELECT MIN(last_update) FROM funding_history) as oldest,
+               (SELECT MAX(last_update) FROM funding_history) as newest
+        FROM funding_history
+    ''').fetchone()
+    return _dumps({
+        'coins': row['coins'],
+        'totalRecords': row['total_records'],
+        'oldestUpdate': row['oldest'],
+        'newestUpdate': row['newest']
+    })
+
+
+CACHE_BUILDERS = {
+    '/api/market-data': _build_market_data,
+    '/api/funding-history': _build_funding_history,
+    '/api/stats': _build_stats,
+}
+
+
+def refresh_cache(conn, endpoint):
+    body = CACHE_BUILDERS[endpoint](conn)
+    # Versão gzip guardada junto, para os hits não recomprimirem
+    body_gz = gzip.compress(body, compresslevel=1) if len(body) > GZIP_MIN_SIZE else None
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    conn.execute('''
+        INSERT OR REPLACE INTO response_cache (endpoint, body, body_gz, etag)
+        VALUES (?, ?, ?, ?)
+    ''', (endpoint, body, body_gz, etag))
+    return body, etag, body_gz
+
+
+def invalidate_cache(conn, endpoint):
+    conn.execute('DELETE FROM response_cache WHERE endpoint = ?', (endpoint,))
+
+
+def get_cached(conn, endpoint):
+    row = conn.execute(
+        'SELECT body, etag, body_gz FROM response_cache WHERE endpoint = ?', (endpoint,)
+    ).fetchone()
+    if row:
+        return row['body'], row['etag'], row['body_gz']
+    # Miss: reconstrói pela conexão de escrita para não competir com os POSTs
+    wconn = get_write_db()
+    try:
+        entry = refresh_cache(wconn, endpoint)
+        wconn.commit()
+    finally:
+        release_write_db(wconn)
+    return entry
+
+
+# ── Hyperliquid HTTP client ──────────────────────────
+# Conexões HTTPS keep-alive reaproveitadas entre chamadas do proxy, evitando
+# um handshake TLS por request. Erros seguem o formato do urlopen.
+
+_HL_POOL = queue.LifoQueue(maxsize=32)
+
+
+def hl_post(body, timeout=60):
+    try:
+        conn = _HL_POOL.get_nowait()
+        reused = True
+    except queue.Empty:
+        conn = http.client.HTTPSConnection(HL_HOST, timeout=timeout)
+        reused = False
+    try:
+        conn.request('POST', '/info', body=body,
+                     headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        result = resp.read()
+    except (ConnectionResetError, BrokenPipeError) as e:
+        conn.close()
+        if reused:
+            return hl_post(body, timeout)  # Keep-alive fechado pelo servidor
+        raise urllib.error.URLError(e)
+    except TimeoutError:
+        # Como no urlopen, timeout sobe sem embrulho e não é repetido
+        conn.close()
+        raise
+    except (http.client.HTTPException, OSError) as e:
+        conn.close()
+        raise urllib.error.URLError(e)
+
+    if resp.will_close:
+        conn.close()
+    else:
+        try:
+            _HL_POOL.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    if resp.status != 200:
+        raise urllib.error.HTTPError(HL_URL, resp.status, resp.reason, resp.headers, None)
+    return result
+
+
+_LABEL_RES = [
+    re.compile(rb'"%s"\s*:\s*"([^"]*)"' % key) for key in (b'coin', b'dex', b'type')
+]
+
+
+def proxy_label(body):
+    # Primeiro de coin/dex/type presente no body, só para os logs do proxy
+    for pattern in _LABEL_RES:
+        m = pattern.search(body)
+        if m:
+            return m.group(1).decode('utf-8', 'replace')
+    return 'unknown'
+
+
+def backoff_delay(attempt):
+    # Exponencial com jitter: ~0.25s, 0.5s, 1s, 2s... (máx 8s) × [0.5, 1.5)
+    return min(8.0, 0.25 * (2 ** attempt)) * (0.5 + random.random())
+
+
+def clear_data(conn):
+    conn.execute('DELETE FROM market_data')
+    conn.execute('DELETE FROM funding_history')
+    conn.execute('DELETE FROM metadata')
+    conn.execute('DELETE FROM response_cache')
+
+
+def resolve_route(path, routes):
+    # Retorna (handler, arg) ou (None, None) se nenhuma rota casar.
+    # arg é o grupo capturado pela regex da rota (None se não houver).
+    for pattern, handler in routes:
+        m = pattern.fullmatch(path)
+        if m:
+            arg = m.group(1) if pattern.groups else None
+            if arg and '%' in arg:
+                arg = urllib.parse.unquote(arg)
+            return handler, arg
+    return None, None
+
+
 class RequestHandler(http.server.SimpleHTTPRequestHandler):
 
     def send_json(self, data, status=200):
+        self.send_json_bytes(_dumps(data), status)
+
+    def wants_gzip(self, body):
+        return (len(body) > GZIP_MIN_SIZE
+                and 'gzip' in self.headers.get('Accept-Encoding', ''))
+
+    def send_json_bytes(self, body, status=200, etag=None, body_gz=None):
+        gzipped = self.wants_gzip(body)
+        if gzipped:
+            body = body_gz or gzip.compress(body, compresslevel=1)
+            if etag:
+                etag += '-gz'  # ETag forte é por content-coding
         try:
-            body = json.dumps(data, ensure_ascii=False)
             self.send_response(status)
             self.send_header('Content-Type', 'application/json; charset=utf-8')
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', str(len(body)))
             self.send_header('Cache-Control', 'no-cache')
+            if etag:
+                self.send_header('ETag', f'"{etag}"')
             self.end_headers()
-            self.wfile.write(body.encode('utf-8'))
+            self.wfile.write(body)
         except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
             pass  # Client disconnected, ignore
 
+    def send_cached(self, body, etag, body_gz=None):
+        # no-cache força revalidação; 304 quando o cliente já tem a versão atual
+        tag = f'{etag}-gz' if self.wants_gzip(body) else etag
+        if f'"{tag}"' in self.headers.get('If-None-Match', ''):
+            try:
+                self.send_response(304)
+                self.send_header('ETag', f'"{tag}"')
+                self.send_header('Vary', 'Accept-Encoding')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+            except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                pass  # Client disconnected, ignore
+            return
+        self.send_json_bytes(body, etag=etag, body_gz=body_gz)
+
     def read_body(self):
         length = int(self.headers.get('Content-Length', 0))
         if length == 0:
             return None
-        return json.loads(self.rfile.read(length))
+        return _loads(self.rfile.read(length))
 
     # ── GET ──────────────────────────────────────────────
     def do_GET(self):
-        path = urllib.parse.urlparse(self.path).path
+        path = self.path.partition('?')[0]
         if not path.startswith('/api/'):
             return super().do_GET()
 
+        handler, arg = resolve_route(path, self.GET_ROUTES)
+        if handler is None:
+            return self.send_json({'error': 'Not found'}, 404)
+
+        # A conexão é devolvida ao pool antes de escrever no socket, para
+        # que clientes lentos não segurem leitores
         conn = get_db()
         try:
-            if path == '/api/market-data':
-                rows = conn.execute('SELECT data FROM market_data').fetchall()
-                self.send_json([json.loads(r['data']) for r in rows])
-
-            elif path == '/api/funding-history':
-                rows = conn.execute('SELECT coin, history FROM funding_history').fetchall()
-                self.send_json({r['coin']: json.loads(r['history']) for r in rows})
-
-            elif path == '/api/funding-history-timestamps':
-                rows = conn.execute('SELECT coin, last_update FROM funding_history').fetchall()
-                self.send_json({r['coin']: r['last_update'] for r in rows})
-
-            elif path.startswith('/api/funding-history/'):
-                coin = urllib.parse.unquote(path[len('/api/funding-history/'):])
-                row = conn.execute(
-                    'SELECT * FROM funding_history WHERE coin = ?', (coin,)
-                ).fetchone()
-                if row:
-                    self.send_json({
-                        'coin': row['coin'],
-                        'history': json.loads(row['history']),
-                        'lastUpdate': row['last_update'],
-                        'recordCount': row['record_count']
-                    })
-                else:
-                    self.send_json(None)
-
-            elif path.startswith('/api/meta/'):
-                key = urllib.parse.unquote(path[len('/api/meta/'):])
-                row = conn.execute(
-                    'SELECT value FROM metadata WHERE key = ?', (key,)
-                ).fetchone()
-                self.send_json({'value': json.loads(row['value']) if row else None})
-
-            elif path == '/api/stats':
-                row = conn.execute('''
-                    SELECT COUNT(*) as coins,
-                           COALESCE(SUM(record_count), 0) as total_records,
-                           MIN(last_update) as oldest,
-                           MAX(last_update) as newest
-                    FROM funding_history
-                ''').fetchone()
-                self.send_json({
-                    'coins': row['coins'],
-                    'totalRecords': row['total_records'],
-                    'oldestUpdate': row['oldest'],
-                    'newestUpdate': row['newest']
-                })
-
-            elif path == '/api/preferences/favorites':
-                row = conn.execute(
-                    "SELECT value FROM user_preferences WHERE key = 'favorites'"
-                ).fetchone()
-                self.send_json(json.loads(row['value']) if row else [])
-
-            elif path == '/api/preferences/blacklist':
-                row = conn.execute(
-                    "SELECT value FROM user_preferences WHERE key = 'blacklist'"
-                ).fetchone()
-                self.send_json(json.loads(row['value']) if row else [])
-
-            elif path == '/api/preferences/newtokens':
-                row = conn.execute(
-                    "SELECT value FROM user_preferences WHERE key = 'newtokens'"
-                ).fetchone()
-                self.send_json(json.loads(row['value']) if row else [])
-
-            else:
-                self.send_json({'error': 'Not found'}, 404)
+            result = handler(self, conn, arg)
         except Exception as e:
-            self.send_json({'error': str(e)}, 500)
+            return self.send_json({'error': str(e)}, 500)
         finally:
-            conn.close()
+            release_db(conn)
+        if isinstance(result, bytes):
+            self.send_json_bytes(result)
+        else:
+            self.send_cached(*result)
+
+    def get_cached_endpoint(self, conn, endpoint):
+        return get_cached(conn, endpoint)
+
+    def get_history_timestamps(self, conn, _):
+        rows = conn.execute('SELECT coin, last_update FROM funding_history').fetchall()
+        return _dumps({r['coin']: r['last_update'] for r in rows})
+
+    def get_coin_history(self, conn, coin):
+        row = conn.execute(
+            'SELECT * FROM funding_history WHERE coin = ?', (coin,)
+        ).fetchone()
+        if not row:
+            return _dumps(None)
+        # history já está serializado; só o envelope é montado aqui
+        return (
+            b'{"coin":' + _dumps(row['coin'])
+            + b',"history":' + row['history'].encode('utf-8')
+            + b',"lastUpdate":' + _dumps(row['last_update'])
+            + b',"recordCount":' + _dumps(row['record_count']) + b'}'
+        )
+
+    def get_meta(self, conn, key):
+        row = conn.execute(
+            'SELECT value FROM metadata WHERE key = ?', (key,)
+        ).fetchone()
+        return _dumps({'value': _loads(row['value']) if row else None})
+
+    def get_preference(self, conn, key):
+        row = conn.execute(
+            'SELECT value FROM user_preferences WHERE key = ?', (key,)
+        ).fetchone()
+        return _dumps(_loads(row['value']) if row else [])
 
     # ── POST ─────────────────────────────────────────────
     def do_POST(self):
-        path = urllib.parse.urlparse(self.path).path
+        path = self.path.partition('?')[0]
         if not path.startswith('/api/'):
             self.send_error(404)
             return
@@ -162,104 +492,102 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
         if path == '/api/proxy':
             return self.handle_proxy()
 
-        data = self.read_body()
-        conn = get_db()
+        if path == '/api/flush':
+            flush_writes()
+            return self.send_json({'ok': True})
+
+        handler, arg = resolve_route(path, self.POST_ROUTES)
+        if handler is None:
+            return self.send_json({'error': 'Not found'}, 404)
+
         try:
-            if path == '/api/market-data':
-                conn.execute('DELETE FROM market_data')
-                for market in (data or []):
-                    conn.execute(
-                        'INSERT INTO market_data (coin, data) VALUES (?, ?)',
-                        (market['coin'], json.dumps(market, ensure_ascii=False))
-                    )
-                conn.commit()
-                self.send_json({'ok': True})
-
-            elif path == '/api/funding-history-bulk':
-                now = int(time.time() * 1000)
-                for coin, history in (data or {}).items():
-                    conn.execute('''
-                        INSERT OR REPLACE INTO funding_history
-                        (coin, history, last_update, record_count)
-                        VALUES (?, ?, ?, ?)
-                    ''', (coin, json.dumps(history), now, len(history)))
-                conn.commit()
-                self.send_json({'ok': True})
-
-            elif path.startswith('/api/funding-history/'):
-                coin = urllib.parse.unquote(path[len('/api/funding-history/'):])
-                history = data.get('history', [])
-                now = int(time.time() * 1000)
-                conn.execute('''
-                    INSERT OR REPLACE INTO funding_history
-                    (coin, history, last_update, record_count)
-                    VALUES (?, ?, ?, ?)
-                ''', (coin, json.dumps(history), now, len(history)))
-                conn.commit()
-                self.send_json({'ok': True})
-
-            elif path == '/api/meta':
-                key = data.get('key')
-                value = data.get('value')
-                now = int(time.time() * 1000)
-                conn.execute('''
-                    INSERT OR REPLACE INTO metadata (key, value, updated_at)
-                    VALUES (?, ?, ?)
-                ''', (key, json.dumps(value), now))
-                conn.commit()
-                self.send_json({'ok': True})
-
-            elif path == '/api/preferences/favorites':
-                now = int(time.time() * 1000)
-                conn.execute('''
-                    INSERT OR REPLACE INTO user_preferences (key, value, updated_at)
-                    VALUES ('favorites', ?, ?)
-                ''', (json.dumps(data), now))
-                conn.commit()
-                self.send_json({'ok': True})
-
-            elif path == '/api/preferences/blacklist':
-                now = int(time.time() * 1000)
-                conn.execute('''
-                    INSERT OR REPLACE INTO user_preferences (key, value, updated_at)
-                    VALUES ('blacklist', ?, ?)
-                ''', (json.dumps(data), now))
-                conn.commit()
-                self.send_json({'ok': True})
-
-            elif path == '/api/preferences/newtokens':
-                now = int(time.time() * 1000)
-                conn.execute('''
-                    INSERT OR REPLACE INTO user_preferences (key, value, updated_at)
-                    VALUES ('newtokens', ?, ?)
-                ''', (json.dumps(data), now))
-                conn.commit()
-                self.send_json({'ok': True})
-
-            else:
-                self.send_json({'error': 'Not found'}, 404)
-        except Exception as e:
-            conn.rollback()
-            self.send_json({'error': str(e)}, 500)
-        finally:
-            conn.close()
+            data = self.read_body()
+        except ValueError as e:
+            return self.send_json({'error': str(e)}, 400)
+        now = int(time.time() * 1000)
+        # A transação e o commit ficam a cargo da thread de escrita. A
+        # resposta não reporta erros de escrita: uma falha aparece só no
+        # log do servidor como "[WRITER] <path> - FAILED"
+        enqueue_write(path, lambda conn: handler(self, conn, data, arg, now))
+        self.send_json({'ok': True, 'queued': True})
+
+    def post_market_data(self, conn, data, _, now):
+        rows = [(m['coin'], _dumps(m).decode('utf-8')) for m in (data or [])]
+        # Upsert só reescreve linhas que mudaram; remove coins que saíram
+        conn.executemany('''
+            INSERT INTO market_data (coin, data) VALUES (?, ?)
+            ON CONFLICT(coin) DO UPDATE SET data = excluded.data
+            WHERE data != excluded.data
+        ''', rows)
+        conn.execute(
+            'DELETE FROM market_data WHERE coin NOT IN (SELECT value FROM json_each(?))',
+            (_dumps([coin for coin, _ in rows]).decode('utf-8'),)
+        )
+        refresh_cache(conn, '/api/market-data')
+
+    def post_history_bulk(self, conn, data, _, now):
+        conn.executemany('''
+            INSERT OR REPLACE INTO funding_history
+            (coin, history, last_update, record_count)
+            VALUES (?, ?, ?, ?)
+        ''', (
+            (coin, _dumps(history).decode('utf-8'), now, len(history))
+            for coin, history in (data or {}).items()
+        ))
+        refresh_cache(conn, '/api/funding-history')
+        refresh_cache(conn, '/api/stats')
+
+    def post_coin_history(self, conn, data, coin, now):
+        history = data.get('history', [])
+        conn.execute('''
+            INSERT OR REPLACE INTO funding_history
+            (coin, history, last_update, record_count)
+            VALUES (?, ?, ?, ?)
+        ''', (coin, _dumps(history).decode('utf-8'), now, len(history)))
+        invalidate_cache(conn, '/api/funding-history')
+        invalidate_cache(conn, '/api/stats')
+
+    def post_meta(self, conn, data, _, now):
+        key = data.get('key')
+        value = data.get('value')
+        conn.execute('''
+            INSERT OR REPLACE INTO metadata (key, value, updated_at)
+            VALUES (?, ?, ?)
+        ''', (key, _dumps(value).decode('utf-8'), now))
+
+    def post_preference(self, conn, data, key, now):
+        conn.execute('''
+            INSERT OR REPLACE INTO user_preferences (key, value, updated_at)
+            VALUES (?, ?, ?)
+        ''', (key, _dumps(data).decode('utf-8'), now))
+
+    # Tabelas de rotas: (regex compilada, handler). O grupo capturado,
+    # quando existe, é passado como arg ao handler.
+    GET_ROUTES = (
+        (re.compile(r'(/api/market-data|/api/funding-history|/api/stats)'), get_cached_endpoint),
+        (re.compile(r'/api/funding-history-timestamps'), get_history_timestamps),
+        (re.compile(r'/api/funding-history/(.+)'), get_coin_history),
+        (re.compile(r'/api/meta/(.+)'), get_meta),
+        (re.compile(r'/api/preferences/(favorites|blacklist|newtokens)'), get_preference),
+    )
+    POST_ROUTES = (
+        (re.compile(r'/api/market-data'), post_market_data),
+        (re.compile(r'/api/funding-history-bulk'), post_history_bulk),
+        (re.compile(r'/api/funding-history/(.+)'), post_coin_history),
+        (re.compile(r'/api/meta'), post_meta),
+        (re.compile(r'/api/preferences/(favorites|blacklist|newtokens)'), post_preference),
+    )
 
     # ── DELETE ────────────────────────────────────────────
     def do_DELETE(self):
-        path = urllib.parse.urlparse(self.path).path
+        path = self.path.partition('?')[0]
         if path == '/api/data':
-            conn = get_db()
-            try:
-                conn.execute('DELETE FROM market_data')
-                conn.execute('DELETE FROM funding_history')
-                conn.execute('DELETE FROM metadata')
-                conn.commit()
-                self.send_json({'ok': True})
-            except Exception as e:
-                conn.rollback()
-                self.send_json({'error': str(e)}, 500)
-            finally:
-                conn.close()
+            # Passa pela fila para ficar ordenado após os POSTs pendentes,
+            # mas só responde depois de aplicado: o frontend recarrega a
+            # página logo em seguida e não pode ver os dados antigos
+            enqueue_write(path, clear_data)
+            flush_writes()
+            self.send_json({'ok': True})
         else:
             self.send_error(404)
 
@@ -269,12 +597,8 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
             length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(length) if length > 0 else b''
 
-            # Parse request to get coin name for logging
-            try:
-                req_data = json.loads(body)
-                coin = req_data.get('coin', req_data.get('dex', req_data.get('type', 'unknown')))
-            except (json.JSONDecodeError, ValueError):
-                coin = 'unknown'
+            # Coin name for logging, without parsing the forwarded body
+            coin = proxy_label(body)
 
             # Retry logic for transient errors
             max_retries = 5
@@ -282,34 +606,26 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
 
             for attempt in range(max_retries):
                 try:
-                    req = urllib.request.Request(
-                        'https://api.hyperliquid.xyz/info',
-                        data=body,
-                        headers={'Content-Type': 'application/json'},
-                        method='POST'
-                    )
-                    with urllib.request.urlopen(req, timeout=60) as resp:
-                        result = resp.read()
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.send_header('Cache-Control', 'no-cache')
-                        self.end_headers()
-                        self.wfile.write(result)
-                        return  # Success, exit
+                    result = hl_post(body)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    self.wfile.write(result)
+                    return  # Success, exit
                 except urllib.error.HTTPError as e:
                     last_error = e
                     print(f"[PROXY] {coin} - HTTP {e.code} (attempt {attempt + 1}/{max_retries})")
+                    # 4xx não é transitório; só 502/503/504 são repetidos
                     if e.code in (502, 503, 504) and attempt < max_retries - 1:
-                        delay = 1.0 * (attempt + 1)  # 1s, 2s, 3s, 4s
-                        time.sleep(delay)
+                        time.sleep(backoff_delay(attempt))
                         continue
                     raise
                 except urllib.error.URLError as e:
                     last_error = e
                     print(f"[PROXY] {coin} - URLError: {e.reason} (attempt {attempt + 1}/{max_retries})")
                     if attempt < max_retries - 1:
-                        delay = 1.0 * (attempt + 1)
-                        time.sleep(delay)
+                        time.sleep(backoff_delay(attempt))
                         continue
                     raise
 
@@ -319,6 +635,15 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
             print(f"[PROXY] {coin} - FAILED: {e}")
             self.send_json({'error': str(e)}, 502)
 
+    # ── STATIC ────────────────────────────────────────────
+    def copyfile(self, source, outputfile):
+        # socket.sendfile usa os.sendfile (zero-copy) quando disponível e
+        # cai sozinho para send() nas plataformas sem suporte
+        if outputfile is self.wfile:
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
     def log_message(self, format, *args):
         if args and '/api/' in str(args[0]):
             super().log_message(format, *args)
@@ -326,13 +651,15 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
 
 if __name__ == '__main__':
     init_db()
+    init_pool()
     PORT = 8000
-    server = http.server.HTTPServer(('', PORT), RequestHandler)
+    server = http.server.ThreadingHTTPServer(('', PORT), RequestHandler)
     print(f'Hyperliquid Funding Analyzer')
     print(f'http://localhost:{PORT}')
     print(f'Ctrl+C to stop')
     try:
         server.serve_forever()
     except KeyboardInterrupt:
+        flush_writes()
         print('\nServer stopped.')
         server.server_close()